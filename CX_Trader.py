@@ -1,15 +1,21 @@
 import argparse
-import requests
-
-import PySimpleGUI as sg
+import threading
+import time
 
 from operator import attrgetter
 
+#requests and PySimpleGUI are imported in the functions that use them,
+#they take longer to load than everything else, see check_import_times.py
+
 materialsDataURL = "https://rest.fnar.net/material/allmaterials"
 CXDataUrl = "https://rest.fnar.net/exchange/all"
 CXOrdersURLFormat = "https://rest.fnar.net/exchange/{ticker}.{cx}"
+#seconds, so a hung connection can't stall a search or --watch forever
+CXRequestTimeout = 30
 
-def findCXGaps(cxMarket, origin, dest, tm3Capacity):
+def findCXGaps(cxMarket, origin, dest, tm3Capacity, orderBooks=None, errors=None):
+    #with an errors list, tickers that fail are added to it as (ticker, exception)
+    #and skipped, instead of the first failure ending the search
     gapFormat = "{ticker} at {origin} : {buyPrice} {buyCount} -> sell {sellCount} at {dest} for {sellPrice}"
     gaps = {}
     for ticker, CXPrices in cxMarket.items():
@@ -17,10 +23,27 @@ def findCXGaps(cxMarket, origin, dest, tm3Capacity):
         destPrices = CXPrices[dest]
         if originPrices.ask and destPrices.bid and originPrices.ask < destPrices.bid:
             print("Processing {ticker}...".format(ticker=ticker))
-            gaps[ticker] = Gap(originPrices, destPrices, tm3Capacity)
+            try:
+                gaps[ticker] = Gap(originPrices, destPrices, tm3Capacity, orderBooks)
+            except Exception as ex:
+                if errors is None:
+                    raise
+                errors.append((ticker, ex))
 
     return gaps
 
+def fetchOrderBook(ticker, cx, orderBooks=None):
+    #orderBooks caches the books by (ticker, cx), pass the same dict to
+    #every findCXGaps/Gap of one market snapshot to download each book once
+    if orderBooks is not None and (ticker, cx) in orderBooks:
+        return orderBooks[(ticker, cx)]
+    import requests
+
+    book = requests.get(CXOrdersURLFormat.format(ticker=ticker, cx=cx), timeout=CXRequestTimeout).json()
+    if orderBooks is not None:
+        orderBooks[(ticker, cx)] = book
+    return book
+
 def printCXGaps(gaps):
     for ticker in getSortedTickers(gaps):
         print(str(gaps[ticker]))
@@ -54,7 +77,7 @@ class Transaction:
         self.profit = (bidPrice - askPrice) * count
 
 class Gap:
-    def __init__(self, originPrices, destPrices, tm3Capacity):
+    def __init__(self, originPrices, destPrices, tm3Capacity, orderBooks=None):
         self.ticker = originPrices.ticker
         self.tm3 = originPrices.tm3
         self.tm3Capacity = tm3Capacity
@@ -70,18 +93,18 @@ class Gap:
         self.totalCost = 0
         self.totalTm3 = 0
         
-        self.__fetchOrders()
+        self.__fetchOrders(orderBooks)
         self.__matchOrders()
         
 
-    def __fetchOrders(self):
-        originReq = requests.get(CXOrdersURLFormat.format(ticker=self.ticker, cx=self.origin))
-        destReq = requests.get(CXOrdersURLFormat.format(ticker=self.ticker, cx=self.dest))
+    def __fetchOrders(self, orderBooks):
+        originBook = fetchOrderBook(self.ticker, self.origin, orderBooks)
+        destBook = fetchOrderBook(self.ticker, self.dest, orderBooks)
 
-        for ask in originReq.json()["SellingOrders"]:
+        for ask in originBook["SellingOrders"]:
             self.asks.append(Order(ask))
 
-        for bid in destReq.json()["BuyingOrders"]:
+        for bid in destBook["BuyingOrders"]:
             self.bids.append(Order(bid))
 
         #sorting- lowest asks and highest bids at the end of the lists
@@ -122,6 +145,20 @@ class Gap:
             self.totalCount += t.count
             self.totalTm3 += t.count * self.tm3
 
+    def transactionsWithin(self, tm3Capacity):
+        #same capacity cut-off as __matchOrders, for a gap matched with more capacity
+        result = []
+        capacity = tm3Capacity
+        for t in self.transactions:
+            if t.count * self.tm3 > capacity:
+                count = int(capacity / self.tm3)
+                if count > 0:
+                    result.append(Transaction(t.askPrice, t.bidPrice, count))
+                break
+            result.append(t)
+            capacity -= t.count * self.tm3
+        return result
+
     def __str__(self):
         result = "{ticker} {origin} -> {dest} Total profit: {totalProfit} amount: {amount}({totalTm3}tm3) costs: {costs}\n".format(ticker=self.ticker, origin=self.origin, dest=self.dest, totalProfit=self.totalProfit, amount=self.totalCount, costs=self.totalCost, totalTm3=self.totalTm3)
         for t in self.transactions:
@@ -133,9 +170,15 @@ def getMaterialTm3(ticker, materialsData):
         if mat["Ticker"] == ticker:
             return max(mat["Weight"], mat["Volume"])
 
-def parseCXOffers(offers):
-    req = requests.get(materialsDataURL)
-    materialsData = req.json()
+def fetchMaterialsData():
+    import requests
+
+    req = requests.get(materialsDataURL, timeout=CXRequestTimeout)
+    return req.json()
+
+def parseCXOffers(offers, materialsData=None):
+    if materialsData is None:
+        materialsData = fetchMaterialsData()
     
     cxMarket = {}
     for offer in offers:
@@ -154,15 +197,96 @@ def strToTm3(strValue):
 def getSortedTickers(gaps):
     return [dictKV[0] for dictKV in sorted(gaps.items(), key=lambda x: x[1].totalProfit, reverse=True)]
 
-def doSearch(origin, dest, tm3Capacity):
-    req = requests.get(CXDataUrl)
+def fetchCXMarket():
+    import requests
+
+    req = requests.get(CXDataUrl, timeout=CXRequestTimeout)
     print(req)
-    cxMarket = parseCXOffers(req.json())
+    return parseCXOffers(req.json())
+
+def doSearch(origin, dest, tm3Capacity):
+    cxMarket = fetchCXMarket()
     gaps = findCXGaps(cxMarket, origin, dest, tm3Capacity)
     printCXGaps(gaps)
     return gaps
 
+def printSink(gap):
+    print(str(gap))
+
+def webhookSink(url):
+    #posts alerts to a Discord (or compatible) webhook
+    def send(gap):
+        import requests
+
+        text = str(gap)
+        #Discord rejects messages longer than 2000 characters
+        if len(text) > 2000:
+            text = text[:1996] + "\n..."
+        req = requests.post(url, json={"content": text}, timeout=CXRequestTimeout)
+        #raising makes watchCXGaps try the gap again on the next poll
+        if req.status_code >= 400:
+            raise Exception("Webhook failed: {status}".format(status=req.status_code))
+    return send
+
+def watchCXGaps(origin, dest, tm3Capacity, minProfit, sink, interval=60, stopEvent=None):
+    #polls the CX summary and reports gaps worth at least minProfit to sink(gap).
+    #Only tickers whose origin ask or destination bid moved since the last
+    #poll and now cross get their order books fetched. A ticker is reported
+    #once when its gap reaches minProfit, and again only after it dropped
+    #below. Returns once stopEvent (a threading.Event) is set.
+    import requests
+
+    if stopEvent is None:
+        stopEvent = threading.Event()
+    materialsData = fetchMaterialsData()
+    tm3ByTicker = {mat["Ticker"]: max(mat["Weight"], mat["Volume"]) for mat in materialsData}
+    lastPrices = {}
+    alerted = set()
+    while not stopEvent.is_set():
+        started = time.monotonic()
+        try:
+            offers = requests.get(CXDataUrl, timeout=CXRequestTimeout).json()
+            summary = {}
+            for offer in offers:
+                if offer["ExchangeCode"] not in (origin, dest):
+                    continue
+                if offer["MaterialTicker"] not in summary:
+                    summary[offer["MaterialTicker"]] = {}
+                summary[offer["MaterialTicker"]][offer["ExchangeCode"]] = offer
+        except (requests.RequestException, ValueError, KeyError, TypeError) as ex:
+            print("CX poll failed:", ex)
+            summary = {}
+        for ticker, cxOffers in summary.items():
+            if stopEvent.is_set():
+                break
+            if origin not in cxOffers or dest not in cxOffers:
+                continue
+            prices = (cxOffers[origin]["Ask"], cxOffers[dest]["Bid"])
+            if lastPrices.get(ticker) == prices:
+                continue
+            try:
+                ask, bid = prices
+                gap = None
+                if ask and bid and ask < bid:
+                    gap = Gap(PriceData(cxOffers[origin], tm3ByTicker.get(ticker)),
+                              PriceData(cxOffers[dest], tm3ByTicker.get(ticker)),
+                              tm3Capacity)
+                if gap is not None and gap.totalProfit >= minProfit:
+                    if ticker not in alerted:
+                        sink(gap)
+                        alerted.add(ticker)
+                else:
+                    alerted.discard(ticker)
+            except Exception as ex:
+                #retried on the next poll, prices only count as seen once evaluated
+                print("Checking", ticker, "failed:", repr(ex))
+                continue
+            lastPrices[ticker] = prices
+        stopEvent.wait(max(0, interval - (time.monotonic() - started)))
+
 def initGUI():
+    import PySimpleGUI as sg
+
     CXes = ("AI1", "CI1", "NC1", "IC1", "CI1", "NC2")
     layout = [[sg.Text("From"), sg.Combo(CXes, key="origin", default_value="CI1", enable_events=True, readonly=True), sg.Text("To"), sg.Combo(CXes, key="dest", default_value="AI1", enable_events=True, readonly=True), sg.Button("Search"), sg.Text("Cargo space t/m3"), sg.Input("500", size=4, key="tm3Capacity", enable_events=True)],
               [sg.Listbox([], size=(4, 20), enable_events=True, select_mode=sg.LISTBOX_SELECT_MODE_SINGLE, key="tradesLB", visible=False), sg.Multiline(disabled=True, size=(100, 20), echo_stdout_stderr=True, key="outputML", visible=False)],
@@ -198,20 +322,24 @@ def initGUI():
     win.close()
 
 def main():
-    #TODO run in console, without UI, if launched with commandline params
-    #parser = argparse.ArgumentParser(description="Search Prosperous Universe CX for price gaps, written by Gilith")
-    #parser.add_argument("origin", default="CI1", help="CX where you buy stuff")
-    #parser.add_argument("dest", help="CX where you sell stuff")
-    #parser.add_argument("tm3Capacity", nargs="?", default=500, help="Cargo hold t / m3")
-    #args = parser.parse_args()
-
-    initGUI()
-    
-    #req = requests.get(CXDataUrl)
-    #print(req)
-    #cxMarket = parseCXOffers(req.json())
-    #gaps = findCXGaps(cxMarket, args.origin, args.dest, args.tm3Capacity)
-    #printCXGaps(gaps)
+    #runs in console, without UI, if launched with commandline params
+    parser = argparse.ArgumentParser(description="Search Prosperous Universe CX for price gaps, written by Gilith")
+    parser.add_argument("origin", nargs="?", help="CX where you buy stuff, opens the GUI if left out")
+    parser.add_argument("dest", nargs="?", default="AI1", help="CX where you sell stuff")
+    parser.add_argument("tm3Capacity", nargs="?", type=float, default=500, help="Cargo hold t / m3")
+    parser.add_argument("--watch", action="store_true", help="keep polling the CX and alert on new gaps")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between polls in watch mode")
+    parser.add_argument("--min-profit", type=float, default=100000, help="smallest matched profit to alert on in watch mode")
+    parser.add_argument("--webhook", help="send watch mode alerts to this Discord webhook instead of stdout")
+    args = parser.parse_args()
+
+    if not args.origin:
+        initGUI()
+    elif args.watch:
+        sink = webhookSink(args.webhook) if args.webhook else printSink
+        watchCXGaps(args.origin, args.dest, args.tm3Capacity, args.min_profit, sink, args.interval)
+    else:
+        doSearch(args.origin, args.dest, args.tm3Capacity)
 
 if __name__ == '__main__':
     main()
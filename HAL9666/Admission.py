@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+
+  def __init__(self, rate, burst):
+    #rate tokens per second, at most burst tokens saved up
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.updated = time.monotonic()
+
+  def refill(self):
+    now = time.monotonic()
+    self.tokens = min(self.burst,
+                      self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+    return self.tokens >= 1
+
+
+class Admission:
+  # Decides whether a command may run right now. Every user has a bucket
+  # shared by all their commands and one per command, so one user can't
+  # hog a command for everyone else. Commands listed in globalLimits also
+  # get a bucket shared by all users, as a cap on what they cost FIO, the
+  # offerings sheet or the Discord send quota in total.
+
+  def __init__(self,
+               userRate,
+               userBurst,
+               commandLimits,
+               defaultLimit,
+               globalLimits=None):
+    self.userRate = userRate
+    self.userBurst = userBurst
+    self.commandLimits = commandLimits
+    self.defaultLimit = defaultLimit
+    self.globalLimits = globalLimits or {}
+    self.userBuckets = {}
+    #(userId, command) -> bucket
+    self.commandBuckets = {}
+    self.globalBuckets = {}
+    self.rejected = 0
+
+  def admit(self, userId, command):
+    if userId not in self.userBuckets:
+      self.userBuckets[userId] = TokenBucket(self.userRate, self.userBurst)
+    if (userId, command) not in self.commandBuckets:
+      self.commandBuckets[(userId, command)] = TokenBucket(
+          *self.commandLimits.get(command, self.defaultLimit))
+    buckets = [self.userBuckets[userId], self.commandBuckets[(userId, command)]]
+    if command in self.globalLimits:
+      if command not in self.globalBuckets:
+        self.globalBuckets[command] = TokenBucket(*self.globalLimits[command])
+      buckets.append(self.globalBuckets[command])
+    #refill all of them, a rejected command doesn't use up tokens from any
+    ready = [bucket.refill() for bucket in buckets]
+    if not all(ready):
+      self.rejected += 1
+      return False
+    for bucket in buckets:
+      bucket.tokens -= 1
+    return True
+
+
+class SingleFlight:
+  # Runs one coroutine per key at a time; callers asking for a key that is
+  # already running wait for that run instead of starting their own.
+
+  def __init__(self):
+    self.inFlight = {}
+
+  async def do(self, key, coroFunc):
+    if key not in self.inFlight:
+      task = asyncio.create_task(coroFunc())
+      self.inFlight[key] = task
+      task.add_done_callback(lambda t: self.inFlight.pop(key, None))
+    return await asyncio.shield(self.inFlight[key])
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import os
+
+Log = logging.getLogger(__name__)
+
+
+class AuctionJournal:
+  # Append-only log of auction events, one JSON object per line:
+  #   create - auction parameters (a compacted snapshot also carries "bids")
+  #   bid    - bidder id and bid value
+  #   extend - new end time after a bid
+  #   stop   - auction stopped or finished
+  # Records are kept in memory by record() and written in batches by
+  # flushLoop(), so the bid path never touches the disk.
+
+  def __init__(self, path, flushInterval=1.0, compactEvery=1000):
+    self.path = path
+    self.flushInterval = flushInterval
+    self.compactEvery = compactEvery
+    self.pending = []
+    self.writtenSinceCompaction = 0
+    # live auction state rebuilt from the records, auction id -> state dict
+    self.auctions = {}
+    self.flushTask = None
+    self.lock = asyncio.Lock()
+
+  def record(self, event, auctionId, **fields):
+    entry = dict(event=event, id=auctionId, **fields)
+    self.apply(entry)
+    self.pending.append(entry)
+
+  def recordCreate(self, auction):
+    self.record("create",
+                auction.id,
+                channel=auction.ctx.channel.id,
+                creator=auction.creator.id,
+                name=auction.name,
+                initialPrice=auction.initialPrice,
+                increments=auction.increments,
+                duration=auction.duration,
+                extension=auction.extension,
+                shipCount=auction.shipCount,
+                endTime=auction.endTime.timestamp(),
+                bids=[(b[0], b[1].id) for b in auction.bidHistory])
+
+  def recordBid(self, auction, bid):
+    self.record("bid", auction.id, value=bid[0], bidder=bid[1].id)
+
+  def recordExtend(self, auction):
+    self.record("extend", auction.id, endTime=auction.endTime.timestamp())
+
+  def recordStop(self, auction):
+    self.record("stop", auction.id)
+
+  def apply(self, entry):
+    auctionId = entry["id"]
+    if entry["event"] == "create":
+      state = dict(entry)
+      del state["event"]
+      state["bids"] = [tuple(b) for b in state.get("bids", [])]
+      self.auctions[auctionId] = state
+      return
+    state = self.auctions.get(auctionId)
+    if state is None:
+      return
+    if entry["event"] == "bid":
+      state["bids"].append((entry["value"], entry["bidder"]))
+    elif entry["event"] == "extend":
+      state["endTime"] = entry["endTime"]
+    elif entry["event"] == "stop":
+      del self.auctions[auctionId]
+
+  def replay(self):
+    self.auctions = {}
+    if not os.path.exists(self.path):
+      return []
+    with open(self.path, encoding="utf-8") as journalFile:
+      for line in journalFile:
+        try:
+          self.apply(json.loads(line))
+        except (ValueError, KeyError):
+          #torn write at the end of the file after a crash
+          Log.warning("Skipping bad journal line: %r", line)
+    #start every run from a compacted journal, so replay time stays bounded
+    self.compact(self.snapshot())
+    return list(self.auctions.values())
+
+  def snapshot(self):
+    return [
+        json.dumps(dict(event="create", **state)) + "\n"
+        for state in self.auctions.values()
+    ]
+
+  def compact(self, lines):
+    tmpPath = self.path + ".tmp"
+    with open(tmpPath, "w", encoding="utf-8") as journalFile:
+      journalFile.write("".join(lines))
+      journalFile.flush()
+      os.fsync(journalFile.fileno())
+    os.replace(tmpPath, self.path)
+    self.writtenSinceCompaction = 0
+
+  def append(self, batch):
+    with open(self.path, "a", encoding="utf-8") as journalFile:
+      journalFile.write("".join(json.dumps(e) + "\n" for e in batch))
+      journalFile.flush()
+      os.fsync(journalFile.fileno())
+    self.writtenSinceCompaction += len(batch)
+
+  async def flush(self):
+    async with self.lock:
+      if not self.pending:
+        return
+      batch = self.pending
+      self.pending = []
+      try:
+        if self.writtenSinceCompaction + len(batch) >= self.compactEvery:
+          #the in-memory state already includes the batch; serialize it here,
+          #records added while the thread writes go into the next batch
+          await asyncio.to_thread(self.compact, self.snapshot())
+        else:
+          await asyncio.to_thread(self.append, batch)
+      except OSError:
+        self.pending = batch + self.pending
+        raise
+
+  async def flushLoop(self):
+    while True:
+      await asyncio.sleep(self.flushInterval)
+      try:
+        await self.flush()
+      except OSError:
+        Log.exception("Writing auction journal failed")
+
+  def close(self):
+    #blocking, for when the loop is gone: writes what the flush loop didn't get to
+    if self.pending:
+      self.append(self.pending)
+      self.pending = []
+
+  def start(self):
+    if self.flushTask is None:
+      self.flushTask = asyncio.create_task(self.flushLoop())
@@ -4,83 +4,86 @@ import discord
 from discord.ext import commands
 
 import asyncio
-import csv
 from datetime import datetime
-from datetime import timedelta
+import itertools
 import logging
 import os
-import requests
+import sys
 
+import threading
+import time
 import traceback
 
+from Admission import Admission
+from Admission import SingleFlight
+from AuctionJournal import AuctionJournal
+from Auctions import Auction
+from Auctions import endTimeMessage
+from Auctions import numberToMilSuffixed
+from Auctions import parseBid
+from Auctions import parseDuration
+from BackgroundCache import BackgroundCache
+from Inventories import InventoryCaches
+from Inventories import SellersCache
+from Inventories import lookupHolders
+from MessageComposer import ApiCallStats
+from MessageComposer import MessageComposer
+import Metrics
+
+#CX_Trader.py lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import CX_Trader
+
 #from keep_alive_flask import keep_alive
 
 ValidChannels = ("auction", "auction-bot-sandbox")
 #ValidChannels = ("auction-bot-sandbox")
-#set to True for debugging
-ShortenHoursToMinutes = False
-
-#corp spreadsheet exported as CSV
-OfferingsCsvUrl = "https://docs.google.com/spreadsheets/d/e/2PACX-1vTU0PDYV0CYk5LObZAFcxIXZNshT27WHvy1CZNmm8paC7eMVmTlCk3rxIFyEY6Tbiz0uiIDG8CxGuCm/pub?gid=0&single=true&output=csv"
-CachedSellersData = {}
-
-FioInventoryUrl = "https://rest.fnar.net/csv/inventory?group={group}&apikey={apikey}"
-FioInventoryShipyardGroup = "41707164"
-FioInventoryEv1lGroup = "83373923"
-CachedShipyardInventories = {}
-CachedEv1lInventories = {}
-ShipPartTickers = (
-    "BR1",
-    "BR2",  #bridges
-    "CQT",
-    "CQS",
-    "CQM",
-    "CQL",  #crew q
-    "FFC",
-    "SFE",
-    "MFE",
-    "LFE",  #FFC, emitters
-    "GEN",
-    "ENG",
-    "FSE",
-    "AEN",
-    "HTE",  #STL engines
-    "RCT",
-    "QCR",
-    "HPR",
-    "HYR",  #FTL engines
-    "SSL",
-    "MSL",
-    "LSL",  #STL fuel tanks
-    "SFL",
-    "MFL",
-    "LFL",  #FTL fuel tanks
-    "TCB",
-    "VSC",
-    "SCB",
-    "MCB",
-    "LCB",
-    "WCB",
-    "VCB",  #cargo bays
-    "SSC",
-    "LHB",
-    "BHP",
-    "RHP",
-    "HHP",
-    "AHP",  #hull plates, SSC
-    "BGS",
-    "AGS",
-    "STS",  #misc
-    "BPT",
-    "APT",
-    "BWH",
-    "AWH",  #whipple shields and thermal protection
-    "RDS",
-    "RDL",  #repair drones
-    "BRP",
-    "ARP",
-    "SRP"  #anti-radiation plates
-)
+
+#local-only text endpoint for Metrics, set BOT_METRICS=0 to disable metrics
+MetricsPort = int(os.getenv("BOT_METRICS_PORT", "9666"))
+
+#exchanges whose pairs are kept in the $arb table, e.g. ARB_EXCHANGES=AI1,CI1,
+#and seconds between recomputing it
+ArbExchanges = [
+    cx.strip()
+    for cx in os.getenv("ARB_EXCHANGES", "AI1,CI1,IC1,NC1").split(",")
+    if cx.strip()
+]
+ArbExchangePairs = tuple(itertools.permutations(ArbExchanges, 2))
+ArbRefreshInterval = 600
+ArbTopCount = 10
+
+#CX_Trader watch mode alerts are posted to this channel, unset to disable
+ArbAlertChannelId = os.getenv("ARB_ALERT_CHANNEL_ID")
+ArbAlertRoute = ("CI1", "AI1")
+ArbAlertCapacity = 500
+ArbAlertMinProfit = 100000
+ArbAlertInterval = 60
+
+#token buckets in front of all commands: (tokens per second, burst).
+#Every user gets their own, GlobalCommandLimits are shared by everyone
+UserCommandLimit = (0.5, 5)
+CommandLimits = {
+    "bid": (1, 5),
+    "status": (0.2, 3),
+    "whohas": (0.2, 3),
+    "arb": (0.2, 3),
+    "help": (0.1, 2),
+}
+DefaultCommandLimit = (0.5, 3)
+#bid has no shared cap, one user's spam mustn't keep others from bidding
+GlobalCommandLimits = {
+    "status": (2, 20),
+    "whohas": (2, 20),
+    "arb": (2, 20),
+    "help": (1, 10),
+}
+
+#append-only log of running auctions, replayed on startup
+AuctionJournalPath = os.getenv(
+    "AUCTION_JOURNAL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 "auctions.journal"))
 
 intents = discord.Intents.default()
 intents.members = True
@@ -92,113 +95,31 @@ bot = commands.Bot(command_prefix='$', intents=intents)
 bot.remove_command("help")
 
 currentAuction = None
+arbAlertThread = None
+ArbAlertStop = threading.Event()
 Log = logging.getLogger(__name__)
+CommandAdmission = Admission(*UserCommandLimit, CommandLimits,
+                             DefaultCommandLimit, GlobalCommandLimits)
+WhohasLookups = SingleFlight()
+Journal = AuctionJournal(AuctionJournalPath)
 
 
-def numberToMilSuffixed(number):
-  mils = number / 1000000
-  if int(mils) == mils:
-    mils = int(mils)
-  return "{value}mil".format(value=mils)
-
-
-class Auction:
-
-  def __init__(self,
-               ctx,
-               creator,
-               name,
-               initialPrice,
-               increments,
-               duration,
-               extension,
-               shipCount=1):
-    self.ctx = ctx
-    self.creator = creator
-    self.name = name
-    self.shipCount = shipCount
-    self.initialPrice = initialPrice
-    self.increments = increments
-    self.duration = duration
-    self.extension = extension
-    delta = timedelta(
-        minutes=self.duration) if ShortenHoursToMinutes else timedelta(
-            hours=self.duration)
-    self.endTime = datetime.now() + delta
-    self.timerStopped = False
-    self.endTimer = asyncio.create_task(Auction.endTimerTick(self))
-    # bid is the following tuple: (bidValue, bidder)
-    self.bidHistory = []
-
-  def currentBid(self):
-    if not self.bidHistory:
-      return None
-    return self.bidHistory[-1]
-
-  def prevBid(self):
-    if not self.bidHistory or len(self.bidHistory) < self.shipCount + 1:
-      return None
-    return self.bidHistory[-1 - self.shipCount]
-
-  def tryBid(self, ctx, bidValue):
-    minBid = self.getMinBid()
-    if bidValue < minBid:
-      print("Bid failed: {bidValue} < {minBid}".format(bidValue=bidValue,
-                                                       minBid=minBid))
-      raise Exception("Minimum bid is {minBid}".format(minBid=minBid))
-    delta = timedelta(
-        minutes=self.extension) if ShortenHoursToMinutes else timedelta(
-            hours=self.extension)
-    newEndTime = datetime.now() + delta
-    if newEndTime > self.endTime:
-      self.endTime = newEndTime
-    newBid = (bidValue, ctx.author)
-    self.bidHistory.append(newBid)
-    self.bidHistory = sorted(self.bidHistory, key=lambda b: b[0])
-    print(newBid)
-    return newBid
-
-  def getMinBid(self):
-    minBid = self.initialPrice
-    if len(self.bidHistory) >= self.shipCount:
-      minBid = self.bidHistory[-self.shipCount][0] + self.increments
-    return minBid
-
-  async def finishAuction(self):
-    print("Auction finishing...")
-    if self.currentBid():
-      for bid in self.bidHistory[:-1 - self.shipCount:
-                                 -1]:  #list slicing magic - last shipCount bids, may be less
-        await self.ctx.send(
-            "{name} sold to {mentionBidder} for {finalPrice}! Congratulations!"
-            .format(name=self.name,
-                    mentionBidder=bid[1].mention,
-                    finalPrice=numberToMilSuffixed(bid[0])))
-    else:
-      await self.ctx.send(
-          "Auction for {name} has ended without any bids...".format(
-              name=self.name))
-    await self.ctx.send(
-        "{mentionCreator}".format(mentionCreator=self.creator.mention))
-    global currentAuction
-    currentAuction = None
+class RestoredMember:
+  #stand-in for a bidder who is not in the client cache after a restart
 
-  def stopAuction(self):
-    self.timerStopped = True
-    global currentAuction
+  def __init__(self, id):
+    self.id = id
+    self.mention = "<@{id}>".format(id=id)
+
+
+def clearCurrentAuction(auction):
+  global currentAuction
+  if currentAuction is auction:
     currentAuction = None
 
-  async def endTimerTick(self):
-    #print("endTimerTick", self)
-    if self.timerStopped:
-      print("Auction timer has stopped!")
-      return
-    if datetime.now() < self.endTime:
-      await asyncio.sleep(60)
-      self.endTimer = asyncio.create_task(Auction.endTimerTick(self))
-    else:
-      self.timerStopped = True
-      await self.finishAuction()
+
+def resolveMember(userId):
+  return bot.get_user(userId) or RestoredMember(userId)
 
 
 def isPriviledgedRole(member):
@@ -209,29 +130,6 @@ def isModeratorRole(member):
   return any(role.name == "moderator" for role in member.roles)
 
 
-def parseBid(bid):
-  result = 0
-  multiplier = 1
-  if bid.endswith("mil"):
-    bid = bid.rstrip("mil")
-    multiplier = 1000000
-  elif bid.lower().endswith("k"):
-    bid = bid.lower().rstrip("k")
-    multiplier = 1000
-  try:
-    result = int(round(float(bid) * multiplier, -4))
-  except:
-    return None
-  return result
-
-
-def parseDuration(duration):
-  try:
-    return int(duration)
-  except:
-    return 0
-
-
 async def createAuction(ctx,
                         creator,
                         name,
@@ -254,22 +152,126 @@ async def createAuction(ctx,
 
   duration = parseDuration(duration)
   extension = parseDuration(extension)
-  return Auction(ctx, creator, name, initialPrice, increments, duration,
-                 extension, shipCount)
-
-
-async def printEndTime(ctx):
+  auction = Auction(ctx,
+                    creator,
+                    name,
+                    initialPrice,
+                    increments,
+                    duration,
+                    extension,
+                    shipCount,
+                    journal=Journal,
+                    onEnd=clearCurrentAuction)
+  Journal.recordCreate(auction)
+  return auction
+
+
+def restoreAuctions():
   global currentAuction
-  if not currentAuction:
-    return
-  await ctx.send("The auction for {name} ends on <t:{endTime}:f>".format(
-      name=currentAuction.name,
-      endTime=int(currentAuction.endTime.timestamp())))
+  for state in Journal.replay():
+    channel = bot.get_channel(state["channel"])
+    if channel is None:
+      print("Can't restore auction", state["name"], "- channel is gone")
+      Journal.record("stop", state["id"])
+      continue
+    if currentAuction:
+      #only one auction can run at a time, keep the newest one
+      print("Dropping restored auction", currentAuction.name)
+      currentAuction.stopAuction()
+    #the channel stands in for ctx, restored auctions only need ctx.send
+    currentAuction = Auction(
+        channel,
+        resolveMember(state["creator"]),
+        state["name"],
+        state["initialPrice"],
+        state["increments"],
+        state["duration"],
+        state["extension"],
+        state["shipCount"],
+        auctionId=state["id"],
+        endTime=datetime.fromtimestamp(state["endTime"]),
+        bidHistory=[(value, resolveMember(bidder))
+                    for (value, bidder) in state["bids"]],
+        journal=Journal,
+        onEnd=clearCurrentAuction)
+    print("Restored auction", currentAuction.name, "with",
+          len(currentAuction.bidHistory), "bids")
 
 
 @bot.event
 async def on_ready():
   print('We have logged in as {0.user}'.format(bot))
+  #on_ready fires again after reconnects, restore only once
+  if Journal.flushTask is None:
+    restoreAuctions()
+    Journal.start()
+    for cache in InventoryCaches.values():
+      cache.start()
+    SellersCache.start()
+    ArbCache.keepFresh()
+    if ArbAlertChannelId:
+      startArbAlerts()
+    await Metrics.start(MetricsPort)
+
+
+@bot.check
+def admitCommand(ctx):
+  #global checks run before argument parsing, so rejecting here is cheap.
+  #Commands ignore bots and other channels anyway, don't spend tokens on them
+  if ctx.author == bot.user or ctx.author.bot:
+    return True
+  if getattr(ctx.channel, "name", None) not in ValidChannels:
+    return True
+  if CommandAdmission.admit(ctx.author.id, ctx.command.name):
+    return True
+  print("Rate limited", ctx.command.name, "from", ctx.author)
+  Metrics.count("rate_limited_commands")
+  return False
+
+
+@bot.event
+async def on_command_error(ctx, error):
+  if isinstance(error, commands.CheckFailure):
+    #rate limited. Replying would only use up more of the send quota, but a
+    #bid that silently didn't count could lose someone the auction
+    if ctx.command is not None and ctx.command.name == "bid":
+      try:
+        await ctx.message.add_reaction("\N{HOURGLASS}")
+      except discord.HTTPException:
+        pass
+    return
+  traceback.print_exception(type(error), error, error.__traceback__)
+
+
+@bot.before_invoke
+async def startCommandTimer(ctx):
+  if Metrics.Enabled:
+    ctx.metricsStart = time.perf_counter()
+
+
+@bot.after_invoke
+async def stopCommandTimer(ctx):
+  if Metrics.Enabled and hasattr(ctx, "metricsStart"):
+    Metrics.observe(
+        "command_{name}_seconds".format(name=ctx.command.name),
+        time.perf_counter() - ctx.metricsStart)
+
+
+def countAuctionTimers():
+  if not currentAuction or currentAuction.endTimer.done():
+    return 0
+  return 1
+
+
+def countDiscordApiCalls():
+  return sum(apiCalls for (runs, apiCalls) in ApiCallStats.values())
+
+
+Metrics.gauge("live_auctions", lambda: 1 if currentAuction else 0)
+Metrics.gauge("auction_timers", countAuctionTimers)
+Metrics.gauge("asyncio_tasks", lambda: len(asyncio.all_tasks()))
+Metrics.gauge("discord_api_calls", countDiscordApiCalls)
+Metrics.gauge("inflight_whohas_lookups", lambda: len(WhohasLookups.inFlight))
 
 
 @bot.command()
@@ -368,38 +370,23 @@ async def bid(ctx, bid):
     return
   if ctx.channel.name not in ValidChannels:
     return
-  if not currentAuction:
-    await ctx.reply("There's no auction running currently!")
-    return
-  try:
-    bid = parseBid(bid)
-    if bid is None:
-      await ctx.reply("Invalid bid!")
+  async with MessageComposer(ctx, "bid") as out:
+    if not currentAuction:
+      out.reply("There's no auction running currently!")
+      return
+    try:
+      bid = parseBid(bid)
+      if bid is None:
+        out.reply("Invalid bid!")
+        return
+      newBid = currentAuction.tryBid(ctx, bid)
+      previousBid = currentAuction.prevBid()
+      await out.react('\N{THUMBS UP SIGN}')
+      currentAuction.announceBid(newBid, previousBid)
+    except Exception as ex:
+      out.reply(ex)
+      print(traceback.format_exc())
       return
-    newBid = currentAuction.tryBid(ctx, bid)
-    previousBid = currentAuction.prevBid()
-    await ctx.message.add_reaction('\N{THUMBS UP SIGN}')
-    if previousBid:
-      await ctx.send(
-          "{newBidder} bids {bid} for {name}! Min. valid bid is now:\n$bid {amount}\n{mentionPrevBidder}, you've been outbid!"
-          .format(newBidder=newBid[1].mention,
-                  name=currentAuction.name,
-                  bid=numberToMilSuffixed(newBid[0]),
-                  amount=numberToMilSuffixed(currentAuction.getMinBid()),
-                  mentionPrevBidder=previousBid[1].mention))
-    else:  #first bid (or multiauction with additional ships are still available)
-      print("1st bid")
-      await ctx.send(
-          "{newBidder} bids {bid} for {name}! Min. valid bid is now:\n$bid {amount}"
-          .format(newBidder=newBid[1].mention,
-                  name=currentAuction.name,
-                  bid=numberToMilSuffixed(newBid[0]),
-                  amount=numberToMilSuffixed(currentAuction.getMinBid())))
-    await printEndTime(ctx)
-  except Exception as ex:
-    await ctx.reply(ex)
-    print(traceback.format_exc())
-    return
 
 
 @bot.command()
@@ -409,28 +396,27 @@ async def status(ctx):
     return
   if ctx.channel.name not in ValidChannels:
     return
-  if not currentAuction:
-    await ctx.reply("There's no auction running!")
-    return
-  if not currentAuction.currentBid():
-    await ctx.send(
-        "There are no bids yet for {name}! To start bidding, use this command:\n$bid {amount}\nThe auction ends on <t:{endTime}:f>"
-        .format(name=currentAuction.name,
-                amount=numberToMilSuffixed(currentAuction.getMinBid()),
-                endTime=int(currentAuction.endTime.timestamp())))
-    return
-  await ctx.send(
-      "Current bid is {bid}. Min. valid bid is now:\n$bid {amount}".format(
-          bid=numberToMilSuffixed(currentAuction.currentBid()[0]),
-          amount=numberToMilSuffixed(currentAuction.getMinBid())))
-  if currentAuction.shipCount > 1:
-    await ctx.send("Current winners:")
-    for bid in currentAuction.bidHistory[:-1 - currentAuction.shipCount:
-                                         -1]:  #list slicing magic - last shipCount bids, may be less
-      await ctx.send("{bidder} at {bid}".format(bidder=bid[1].mention,
-                                                bid=numberToMilSuffixed(
-                                                    bid[0])))
-  await printEndTime(ctx)
+  async with MessageComposer(ctx, "status") as out:
+    if not currentAuction:
+      out.reply("There's no auction running!")
+      return
+    if not currentAuction.currentBid():
+      out.add(
+          "There are no bids yet for {name}! To start bidding, use this command:\n$bid {amount}\nThe auction ends on <t:{endTime}:f>"
+          .format(name=currentAuction.name,
+                  amount=numberToMilSuffixed(currentAuction.getMinBid()),
+                  endTime=int(currentAuction.endTime.timestamp())))
+      return
+    out.add(
+        "Current bid is {bid}. Min. valid bid is now:\n$bid {amount}".format(
+            bid=numberToMilSuffixed(currentAuction.currentBid()[0]),
+            amount=numberToMilSuffixed(currentAuction.getMinBid())))
+    if currentAuction.shipCount > 1:
+      out.add("Current winners:")
+      for bid in currentAuction.winners():
+        out.add("{bidder} at {bid}".format(bidder=bid[1].mention,
+                                           bid=numberToMilSuffixed(bid[0])))
+    out.add(endTimeMessage(currentAuction))
 
 
 @bot.command()
@@ -459,62 +445,14 @@ async def help(ctx):
     return
   if ctx.channel.name not in ValidChannels:
     return
-  await ctx.send(
-      '$auctionstart [name] [initial_price] [price_increments] [duration_hours] [extension_hours]\nStarts a new auction. First bid must be at least equal to *initial_price*, each new bid must be bigger by at least *price_increments*. The auction will last for *duration_hours* (default 48), or *extension_hours* (default 24) after a new bid has been placed.\\Example:\n$auctionstart "WCB ship" 2mil 50k'
-  )
-  await ctx.send("$auctionstop\nStops the current auction.")
-  await ctx.send(
-      "$bid [price]\nPlaces a new bid. Examples:\n$bid 4mil\nbid 4.25mil\n")
-  await ctx.send("$status\nShows current auction status")
-
-
-async def findInInventories(ctx, ticker):
-  global CachedShipyardInventories
-  global CachedEv1lInventories
-  isShipPartTicker = ticker in ShipPartTickers
-  fioUrl = FioInventoryUrl.format(
-      apikey=os.getenv("FIO_API_KEY"),
-      group=(FioInventoryShipyardGroup
-             if isShipPartTicker else FioInventoryEv1lGroup))
-  inventories = {}
-  response = requests.get(fioUrl)
-  if response.status_code != 200:
-    await ctx.reply(
-        "Error fetching inventory from FIO. status: {status}. Falling back to cached data"
-        .format(status=response.status_code))
-    inventories = CachedShipyardInventories if isShipPartTicker else CachedEv1lInventories
-  else:
-    csvData = csv.DictReader(response.text.split("\r\n"))
-
-    for row in csvData:
-      if row["Username"] not in inventories:
-        inventories[row["Username"]] = {}
-      if row["Ticker"] not in inventories[row["Username"]]:
-        inventories[row["Username"]][row["Ticker"]] = 0
-      inventories[row["Username"]][row["Ticker"]] += int(row["Amount"])
-    if isShipPartTicker:
-      CachedShipyardInventories = inventories
-    else:
-      CachedEv1lInventories = inventories
-  result = []
-  for (user, inv) in inventories.items():
-    if ticker in inv:
-      result.append((user, inv[ticker]))
-  return sorted(result, key=lambda x: x[1])[::-1]
-
-
-def getSellers(ticker):
-  global CachedSellersData
-  result = []
-  response = requests.get(OfferingsCsvUrl)
-  if response.status_code == 200:
-    CachedSellersData = csv.DictReader(response.text.split("\r\n"))
-  if CachedSellersData:
-    result = [
-        row["Seller"].upper() for row in CachedSellersData
-        if row["MAT"] == ticker
-    ]
-  return result
+  async with MessageComposer(ctx, "help") as out:
+    out.add(
+        '$auctionstart [name] [initial_price] [price_increments] [duration_hours] [extension_hours]\nStarts a new auction. First bid must be at least equal to *initial_price*, each new bid must be bigger by at least *price_increments*. The auction will last for *duration_hours* (default 48), or *extension_hours* (default 24) after a new bid has been placed.\\Example:\n$auctionstart "WCB ship" 2mil 50k\n'
+    )
+    out.add("$auctionstop\nStops the current auction.\n")
+    out.add(
+        "$bid [price]\nPlaces a new bid. Examples:\n$bid 4mil\nbid 4.25mil\n")
+    out.add("$status\nShows current auction status")
 
 
 @bot.command()
@@ -527,26 +465,157 @@ async def whohas(ctx, ticker, all=""):
   if not isPriviledgedRole(ctx.author):
     await ctx.reply("You don't have permissions to run this command!")
     return
-  Log.info("whohas", ticker)
-  result = await findInInventories(ctx, ticker.upper())
-  #print(str(result))
-  print("Full:", str(result))
-  if not shouldReturnAll:
-    sellers = getSellers(ticker.upper())
-    print("Sellers:", str(sellers))
-    result = [(u, a) for (u, a) in result if u in sellers]
-  if len(result) == 0:
-    await ctx.reply(
-        "As far as I know, nobody has {ticker}".format(ticker=ticker))
+  Log.info("whohas %s", ticker)
+  async with MessageComposer(ctx, "whohas") as out:
+    try:
+      #identical lookups running at the same time share one result
+      result = await WhohasLookups.do(
+          (ticker.upper(), shouldReturnAll),
+          lambda: lookupHolders(ticker.upper(), shouldReturnAll))
+    except Exception:
+      out.reply("Error fetching inventory from FIO, try again later")
+      return
+    if len(result) == 0:
+      out.reply("As far as I know, nobody has {ticker}".format(ticker=ticker))
+      return
+    formattedResult = [
+        "{user} has {amount} {ticker}".format(user=u,
+                                              amount=a,
+                                              ticker=ticker.upper())
+        for (u, a) in result
+    ]
+    print("Filtered:", str(formattedResult))
+    for line in formattedResult:
+      out.reply(line)
+
+
+def fetchArbTable():
+  #blocking, runs the whole CX_Trader pipeline in a worker thread of ArbCache.
+  #Gaps are matched without a cargo limit, $arb cuts them down to size later.
+  #Every pair shares the order books, each ticker.cx is downloaded once
+  cxMarket = CX_Trader.fetchCXMarket()
+  orderBooks = {}
+  table = {}
+  errors = []
+  for (origin, dest) in ArbExchangePairs:
+    #a failed order book or a ticker without tm3 only drops that gap
+    gaps = CX_Trader.findCXGaps(cxMarket, origin, dest, float("inf"),
+                                orderBooks, errors)
+    table[(origin, dest)] = [gaps[t] for t in CX_Trader.getSortedTickers(gaps)]
+  if errors:
+    Log.warning("%d gaps left out of the arb table, first: %s %r", len(errors),
+                *errors[0])
+    Metrics.count("arb_table_gap_errors", len(errors))
+    #nothing worked (FIO down?), keep serving the previous table instead
+    if not any(table.values()):
+      raise errors[0][1]
+  return table
+
+
+ArbCache = BackgroundCache("cx arbitrage table", fetchArbTable,
+                           ArbRefreshInterval)
+
+
+def rankGaps(gaps, tm3Capacity):
+  result = []
+  for gap in gaps:
+    transactions = gap.transactionsWithin(tm3Capacity)
+    if transactions:
+      result.append((gap, transactions, sum(t.profit for t in transactions)))
+  return sorted(result, key=lambda x: x[2], reverse=True)
+
+
+@bot.command()
+async def arb(ctx, origin, dest, tm3Capacity="500"):
+  if ctx.author == bot.user or ctx.author.bot:
     return
-  formattedResult = [
-      "{user} has {amount} {ticker}".format(user=u,
-                                            amount=a,
-                                            ticker=ticker.upper())
-      for (u, a) in result
-  ]
-  print("Filtered:", str(formattedResult))
-  await ctx.reply("\n".join(formattedResult))
+  if ctx.channel.name not in ValidChannels:
+    return
+  async with MessageComposer(ctx, "arb") as out:
+    if not isPriviledgedRole(ctx.author):
+      out.reply("You don't have permissions to run this command!")
+      return
+    origin = origin.upper()
+    dest = dest.upper()
+    tm3Capacity = CX_Trader.strToTm3(tm3Capacity)
+    if tm3Capacity <= 0:
+      out.reply("Invalid cargo space!")
+      return
+    #answer from whatever table is in memory, never fetch from here
+    table = ArbCache.value
+    if table is None:
+      out.reply("The CX table isn't ready yet, try again in a few minutes")
+      return
+    if (origin, dest) not in table:
+      out.reply("I only track these routes: {pairs}".format(pairs=", ".join(
+          "{0}->{1}".format(*pair) for pair in ArbExchangePairs)))
+      return
+    ranked = rankGaps(table[(origin, dest)], tm3Capacity)[:ArbTopCount]
+    if not ranked:
+      out.reply("No profitable trades from {origin} to {dest} right now".format(
+          origin=origin, dest=dest))
+      return
+    out.reply("Best trades from {origin} to {dest} for {tm3Capacity}t/m3:".format(
+        origin=origin, dest=dest, tm3Capacity=tm3Capacity))
+    for (gap, transactions, profit) in ranked:
+      count = sum(t.count for t in transactions)
+      out.reply(
+          "{ticker}: buy {count} for {cost}, profit {profit} ({tm3:.1f}t/m3)"
+          .format(ticker=gap.ticker,
+                  count=count,
+                  cost=sum(t.askPrice * t.count for t in transactions),
+                  profit=profit,
+                  tm3=count * gap.tm3))
+
+
+async def sendArbAlert(channel, text):
+  async with MessageComposer(channel, "arb alert") as out:
+    out.add(text)
+
+
+def watchArbGaps(sink):
+  try:
+    CX_Trader.watchCXGaps(*ArbAlertRoute, ArbAlertCapacity, ArbAlertMinProfit,
+                          sink, ArbAlertInterval, ArbAlertStop)
+  except Exception:
+    Log.exception("Arb alert watcher stopped")
+
+
+def startArbAlerts():
+  global arbAlertThread
+  channel = bot.get_channel(int(ArbAlertChannelId))
+  if channel is None:
+    print("Arb alert channel", ArbAlertChannelId, "not found")
+    return
+  loop = asyncio.get_running_loop()
+
+  def sink(gap):
+    #called from the watch thread, waits for the send so a failed one raises
+    #there and the gap is alerted again on the next poll
+    asyncio.run_coroutine_threadsafe(sendArbAlert(channel, str(gap)),
+                                     loop).result(timeout=60)
+
+  #a daemon thread rather than asyncio.to_thread, the default executor is
+  #waited on when the loop shuts down and the watcher never returns by itself
+  arbAlertThread = threading.Thread(target=watchArbGaps,
+                                    args=(sink,),
+                                    name="arb alerts",
+                                    daemon=True)
+  arbAlertThread.start()
+
+
+@bot.command()
+async def metrics(ctx):
+  if ctx.author == bot.user or ctx.author.bot:
+    return
+  if ctx.channel.name not in ValidChannels:
+    return
+  async with MessageComposer(ctx, "metrics") as out:
+    if not isPriviledgedRole(ctx.author):
+      out.reply("You don't have permissions to run this command!")
+      return
+    for line in Metrics.renderSummary():
+      out.reply(line)
 
 
 @bot.command()
@@ -559,5 +628,13 @@ async def clearchannel(ctx):
   await ctx.channel.purge()
 
 
-#keep_alive()
-bot.run(os.getenv('DISCORD_TOKEN'))
+def main():
+  #keep_alive()
+  bot.run(os.getenv('DISCORD_TOKEN'))
+  ArbAlertStop.set()
+  #bids of the last flushInterval were already confirmed, don't lose them
+  Journal.close()
+
+
+if __name__ == '__main__':
+  main()
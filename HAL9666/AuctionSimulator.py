@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import contextlib
+from datetime import datetime
+from datetime import timedelta
+import io
+import json
+import random
+import selectors
+import sys
+import time
+
+from Auctions import Auction
+from Auctions import BidAnnounceWindow
+from Auctions import parseBid
+
+# Runs Auction objects against scripted or random bid streams in virtual
+# time: the event loop jumps straight to the next timer instead of waiting
+# for it, so a week of auctions takes seconds. Every auction is checked for
+# its end time, extensions, rejected bids and winners.
+
+
+class VirtualTimeSelector(selectors.DefaultSelector):
+
+  def __init__(self):
+    super().__init__()
+    self.now = 0.0
+
+  def select(self, timeout=None):
+    #the loop asks to wait until its next timer - skip the wait instead
+    if timeout is None:
+      raise RuntimeError("Simulation is stuck: nothing is scheduled")
+    self.now += timeout
+    return super().select(0)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+
+  def __init__(self):
+    self.virtualSelector = VirtualTimeSelector()
+    super().__init__(self.virtualSelector)
+
+  def time(self):
+    return self.virtualSelector.now
+
+
+class VirtualClock:
+
+  def __init__(self, start):
+    self.start = start
+
+  def now(self):
+    return self.start + timedelta(seconds=self.monotonic())
+
+  def monotonic(self):
+    return asyncio.get_running_loop().time()
+
+  async def sleep(self, seconds):
+    await asyncio.sleep(seconds)
+
+
+class SimMember:
+
+  def __init__(self, id, name):
+    self.id = id
+    self.name = name
+    self.mention = "<@{id}>".format(id=id)
+
+
+class SimChannel:
+  #collects what the auction would send to Discord
+
+  def __init__(self, clock):
+    self.clock = clock
+    self.messages = []
+
+  async def send(self, text):
+    self.messages.append((self.clock.now(), text))
+
+
+class SimContext:
+
+  def __init__(self, author, channel):
+    self.author = author
+    self.channel = channel
+
+
+def randomScenario(rng, auctionCount, days, bidderCount):
+  #times ("start", "at") are hours since the start of the simulation, bids
+  #are "steps" of increments above the min. bid at that moment
+  auctions = []
+  for i in range(auctionCount):
+    start = rng.uniform(0, days * 24 / 2)
+    duration = rng.choice((12, 24, 48, 72))
+    extension = rng.choice((1, 6, 12, 24))
+    increments = rng.choice((10000, 50000, 100000))
+    bids = []
+    at = start
+    while True:
+      at += rng.expovariate(1 / 3)
+      if at > days * 24:
+        break
+      bids.append({
+          "at": at,
+          "bidder": rng.randrange(bidderCount),
+          #steps of -1 make some bids fall below the minimum
+          "steps": rng.choice((-1, 0, 0, 1, 2, 5))
+      })
+    auctions.append({
+        "name": "Ship {i}".format(i=i),
+        "start": start,
+        "initialPrice": rng.choice((1000000, 2000000, 5000000)),
+        "increments": increments,
+        "duration": duration,
+        "extension": extension,
+        "shipCount": rng.choice((1, 1, 2, 3)),
+        "bids": bids
+    })
+  return auctions
+
+
+class AuctionRun:
+  # One scenario auction: places its bids at their virtual times and keeps
+  # its own model of what the auction should do, to check the Auction against.
+
+  def __init__(self, spec, clock, bidders):
+    self.spec = spec
+    self.clock = clock
+    self.bidders = bidders
+    self.channel = SimChannel(clock)
+    self.ended = asyncio.Event()
+    self.endedAt = None
+    self.accepted = []
+    self.expectedEnd = None
+    self.rejected = 0
+    self.failures = []
+
+  def fail(self, message):
+    self.failures.append("{name}: {message}".format(name=self.spec["name"],
+                                                    message=message))
+
+  def expectedMinBid(self, auction):
+    if len(self.accepted) < auction.shipCount:
+      return auction.initialPrice
+    return sorted(self.accepted,
+                  key=lambda b: b[0])[-auction.shipCount][0] + auction.increments
+
+  def onEnd(self, auction):
+    self.endedAt = self.clock.now()
+    self.ended.set()
+
+  async def run(self, startTime):
+    spec = self.spec
+    await asyncio.sleep(spec["start"] * 3600)
+    #the channel stands in for ctx, as it does for restored auctions
+    auction = Auction(self.channel,
+                      SimMember(0, "creator"),
+                      spec["name"],
+                      parseBid(str(spec["initialPrice"])),
+                      parseBid(str(spec["increments"])),
+                      spec["duration"],
+                      spec["extension"],
+                      spec.get("shipCount", 1),
+                      onEnd=self.onEnd,
+                      clock=self.clock)
+    self.expectedEnd = self.clock.now() + timedelta(hours=spec["duration"])
+    for bid in sorted(spec["bids"], key=lambda b: b["at"]):
+      await asyncio.sleep(
+          max(0, startTime + bid["at"] * 3600 - self.clock.monotonic()))
+      if auction.timerStopped:
+        break
+      self.placeBid(auction, bid)
+    await self.ended.wait()
+    self.check(auction)
+
+  def placeBid(self, auction, bid):
+    bidder = self.bidders[bid["bidder"] % len(self.bidders)]
+    minBid = self.expectedMinBid(auction)
+    if "value" in bid:
+      value = parseBid(str(bid["value"]))
+    else:
+      value = minBid + bid["steps"] * auction.increments
+    try:
+      auction.tryBid(SimContext(bidder, self.channel), value)
+      accepted = True
+    except Exception:
+      accepted = False
+    if accepted != (value >= minBid):
+      self.fail("bid of {value} was {result}, min. bid was {minBid}".format(
+          value=value,
+          result="accepted" if accepted else "rejected",
+          minBid=minBid))
+    if not accepted:
+      self.rejected += 1
+      return
+    self.accepted.append((value, bidder))
+    extendedEnd = self.clock.now() + timedelta(hours=auction.extension)
+    if extendedEnd > self.expectedEnd:
+      self.expectedEnd = extendedEnd
+    auction.announceBid((value, bidder), auction.prevBid())
+
+  def check(self, auction):
+    if auction.endTime != self.expectedEnd:
+      self.fail("ends at {actual}, expected {expected}".format(
+          actual=auction.endTime, expected=self.expectedEnd))
+    #the end timer ticks once a minute
+    if not self.expectedEnd <= self.endedAt <= self.expectedEnd + timedelta(
+        seconds=61):
+      self.fail("finished at {actual}, expected {expected}".format(
+          actual=self.endedAt, expected=self.expectedEnd))
+    expectedWinners = sorted(self.accepted,
+                             key=lambda b: b[0])[:-1 - auction.shipCount:-1]
+    if [(v, b.id) for (v, b) in auction.winners()
+       ] != [(v, b.id) for (v, b) in expectedWinners]:
+      self.fail("winners {actual}, expected {expected}".format(
+          actual=[(v, b.name) for (v, b) in auction.winners()],
+          expected=[(v, b.name) for (v, b) in expectedWinners]))
+    finalMessages = "\n".join(text for (at, text) in self.channel.messages
+                              if at >= self.expectedEnd)
+    for (value, bidder) in expectedWinners:
+      if "sold to {mention}".format(mention=bidder.mention) not in finalMessages:
+        self.fail("{bidder} wasn't announced as a winner".format(
+            bidder=bidder.name))
+    if not expectedWinners and "without any bids" not in finalMessages:
+      self.fail("missing the no bids message")
+
+
+async def simulate(auctionSpecs, bidderCount):
+  clock = VirtualClock(datetime(2024, 1, 1))
+  bidders = [SimMember(i + 1, "bidder{i}".format(i=i)) for i in range(bidderCount)]
+  runs = [AuctionRun(spec, clock, bidders) for spec in auctionSpecs]
+  startTime = clock.monotonic()
+  await asyncio.gather(*(run.run(startTime) for run in runs))
+  #let the last bid announcements go out
+  await asyncio.sleep(BidAnnounceWindow + 1)
+  return runs, clock.monotonic() - startTime
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description="Fast-forward Auction timing logic in virtual time")
+  parser.add_argument("--scenario",
+                      help="JSON file with a list of auctions like randomScenario makes, "
+                      "bids may give a \"value\" instead of \"steps\"")
+  parser.add_argument("--auctions", type=int, default=20, help="random auctions to run")
+  parser.add_argument("--days", type=float, default=7, help="simulated days of random bids")
+  parser.add_argument("--bidders", type=int, default=10)
+  parser.add_argument("--seed", type=int, default=None)
+  args = parser.parse_args()
+
+  if args.scenario:
+    with open(args.scenario, encoding="utf-8") as scenarioFile:
+      auctionSpecs = json.load(scenarioFile)
+  else:
+    seed = args.seed if args.seed is not None else random.randrange(1000000)
+    print("Random scenario, seed", seed)
+    auctionSpecs = randomScenario(random.Random(seed), args.auctions, args.days,
+                                  args.bidders)
+
+  loop = VirtualTimeLoop()
+  started = time.perf_counter()
+  #Auction and MessageComposer print every bid and send
+  with contextlib.redirect_stdout(io.StringIO()):
+    runs, simulated = loop.run_until_complete(
+        simulate(auctionSpecs, args.bidders))
+  loop.close()
+  elapsed = time.perf_counter() - started
+
+  failures = [f for run in runs for f in run.failures]
+  print(
+      "Simulated {days:.1f} days of {auctions} auctions, {bids} bids ({rejected} rejected) in {elapsed:.2f}s"
+      .format(days=simulated / 86400,
+              auctions=len(runs),
+              bids=sum(len(run.accepted) + run.rejected for run in runs),
+              rejected=sum(run.rejected for run in runs),
+              elapsed=elapsed))
+  for failure in failures:
+    print("FAILED", failure)
+  sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,240 @@
+import asyncio
+from datetime import datetime
+from datetime import timedelta
+import logging
+import time
+import uuid
+
+from MessageComposer import MessageComposer
+
+Log = logging.getLogger(__name__)
+
+#set to True for debugging
+ShortenHoursToMinutes = False
+#bids placed within this many seconds are announced in one message
+BidAnnounceWindow = 3
+
+
+class SystemClock:
+  #time source of an Auction, AuctionSimulator swaps in a virtual one
+
+  def now(self):
+    return datetime.now()
+
+  def monotonic(self):
+    return time.monotonic()
+
+  async def sleep(self, seconds):
+    await asyncio.sleep(seconds)
+
+
+DefaultClock = SystemClock()
+
+
+def numberToMilSuffixed(number):
+  mils = number / 1000000
+  if int(mils) == mils:
+    mils = int(mils)
+  return "{value}mil".format(value=mils)
+
+
+class Auction:
+
+  def __init__(self,
+               ctx,
+               creator,
+               name,
+               initialPrice,
+               increments,
+               duration,
+               extension,
+               shipCount=1,
+               auctionId=None,
+               endTime=None,
+               bidHistory=None,
+               journal=None,
+               onEnd=None,
+               clock=None):
+    self.id = auctionId or uuid.uuid4().hex
+    self.clock = clock or DefaultClock
+    #AuctionJournal to record bids in, and a callback run when the auction
+    #finishes or is stopped
+    self.journal = journal
+    self.onEnd = onEnd
+    self.ctx = ctx
+    self.creator = creator
+    self.name = name
+    self.shipCount = shipCount
+    self.initialPrice = initialPrice
+    self.increments = increments
+    self.duration = duration
+    self.extension = extension
+    if endTime is None:
+      delta = timedelta(
+          minutes=self.duration) if ShortenHoursToMinutes else timedelta(
+              hours=self.duration)
+      endTime = self.clock.now() + delta
+    self.endTime = endTime
+    self.timerStopped = False
+    self.endTimer = asyncio.create_task(Auction.endTimerTick(self))
+    # bid is the following tuple: (bidValue, bidder)
+    self.bidHistory = sorted(bidHistory or [], key=lambda b: b[0])
+    self.pendingBids = []
+    self.outbidMembers = []
+    self.announceTask = None
+    self.lastAnnounce = 0
+
+  def currentBid(self):
+    if not self.bidHistory:
+      return None
+    return self.bidHistory[-1]
+
+  def prevBid(self):
+    if not self.bidHistory or len(self.bidHistory) < self.shipCount + 1:
+      return None
+    return self.bidHistory[-1 - self.shipCount]
+
+  def tryBid(self, ctx, bidValue):
+    minBid = self.getMinBid()
+    if bidValue < minBid:
+      print("Bid failed: {bidValue} < {minBid}".format(bidValue=bidValue,
+                                                       minBid=minBid))
+      raise Exception("Minimum bid is {minBid}".format(minBid=minBid))
+    delta = timedelta(
+        minutes=self.extension) if ShortenHoursToMinutes else timedelta(
+            hours=self.extension)
+    newEndTime = self.clock.now() + delta
+    newBid = (bidValue, ctx.author)
+    self.bidHistory.append(newBid)
+    self.bidHistory = sorted(self.bidHistory, key=lambda b: b[0])
+    if self.journal:
+      self.journal.recordBid(self, newBid)
+    if newEndTime > self.endTime:
+      self.endTime = newEndTime
+      if self.journal:
+        self.journal.recordExtend(self)
+    print(newBid)
+    return newBid
+
+  def getMinBid(self):
+    minBid = self.initialPrice
+    if len(self.bidHistory) >= self.shipCount:
+      minBid = self.bidHistory[-self.shipCount][0] + self.increments
+    return minBid
+
+  def winners(self):
+    #list slicing magic - last shipCount bids, may be less
+    return self.bidHistory[:-1 - self.shipCount:-1]
+
+  def announceBid(self, newBid, previousBid):
+    self.pendingBids.append(newBid)
+    if previousBid:
+      self.outbidMembers.append(previousBid[1])
+    if self.announceTask is None:
+      self.announceTask = asyncio.create_task(self.announceBids())
+
+  async def announceBids(self):
+    #the first bid is announced right away, bids following it within
+    #BidAnnounceWindow are collected into a single message
+    delay = self.lastAnnounce + BidAnnounceWindow - self.clock.monotonic()
+    if delay > 0:
+      await self.clock.sleep(delay)
+    bids = self.pendingBids
+    outbidMembers = self.outbidMembers
+    self.pendingBids = []
+    self.outbidMembers = []
+    self.announceTask = None
+    self.lastAnnounce = self.clock.monotonic()
+    #runs as its own task, a failed send would otherwise go unnoticed
+    try:
+      async with MessageComposer(self.ctx, "bid announcement") as out:
+        for newBid in bids:
+          out.add("{newBidder} bids {bid} for {name}!".format(
+              newBidder=newBid[1].mention,
+              name=self.name,
+              bid=numberToMilSuffixed(newBid[0])))
+        if not self.timerStopped:
+          out.add("Min. valid bid is now:\n$bid {amount}".format(
+              amount=numberToMilSuffixed(self.getMinBid())))
+        #skip bidders who got back among the winners since they were outbid
+        winnerIds = {bid[1].id for bid in self.winners()}
+        mentions = []
+        for member in outbidMembers:
+          if member.id not in winnerIds and member.mention not in mentions:
+            mentions.append(member.mention)
+        if mentions:
+          out.add("{mentionPrevBidders}, you've been outbid!".format(
+              mentionPrevBidders=", ".join(mentions)))
+        if not self.timerStopped:
+          out.add(endTimeMessage(self))
+    except Exception:
+      Log.exception("Announcing %d bids for %s failed, outbid: %s", len(bids),
+                    self.name, ", ".join(m.mention for m in outbidMembers))
+
+  async def finishAuction(self):
+    print("Auction finishing...")
+    if self.announceTask:
+      await self.announceTask
+    async with MessageComposer(self.ctx, "finishAuction") as out:
+      if self.currentBid():
+        for bid in self.winners():
+          out.add(
+              "{name} sold to {mentionBidder} for {finalPrice}! Congratulations!"
+              .format(name=self.name,
+                      mentionBidder=bid[1].mention,
+                      finalPrice=numberToMilSuffixed(bid[0])))
+      else:
+        out.add("Auction for {name} has ended without any bids...".format(
+            name=self.name))
+      out.add("{mentionCreator}".format(mentionCreator=self.creator.mention))
+    self.ended()
+
+  def stopAuction(self):
+    self.timerStopped = True
+    self.ended()
+
+  def ended(self):
+    if self.journal:
+      self.journal.recordStop(self)
+    if self.onEnd:
+      self.onEnd(self)
+
+  async def endTimerTick(self):
+    #print("endTimerTick", self)
+    if self.timerStopped:
+      print("Auction timer has stopped!")
+      return
+    if self.clock.now() < self.endTime:
+      await self.clock.sleep(60)
+      self.endTimer = asyncio.create_task(Auction.endTimerTick(self))
+    else:
+      self.timerStopped = True
+      await self.finishAuction()
+
+
+def parseBid(bid):
+  result = 0
+  multiplier = 1
+  if bid.endswith("mil"):
+    bid = bid.rstrip("mil")
+    multiplier = 1000000
+  elif bid.lower().endswith("k"):
+    bid = bid.lower().rstrip("k")
+    multiplier = 1000
+  try:
+    result = int(round(float(bid) * multiplier, -4))
+  except:
+    return None
+  return result
+
+
+def parseDuration(duration):
+  try:
+    return int(duration)
+  except:
+    return 0
+
+
+def endTimeMessage(auction):
+  return "The auction for {name} ends on <t:{endTime}:f>".format(
+      name=auction.name, endTime=int(auction.endTime.timestamp()))
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import re
+import time
+
+import Metrics
+
+Log = logging.getLogger(__name__)
+
+
+class BackgroundCache:
+  # Stale-while-revalidate cache around a blocking fetch function.
+  # get() returns the cached value straight away and refreshes it in a worker
+  # thread once it is older than ttl seconds. Concurrent refreshes share one
+  # fetch, and callers only wait when nothing has been fetched yet.
+
+  def __init__(self, name, fetch, ttl):
+    self.name = name
+    self.metricName = re.sub(r"\W+", "_", name.lower()).strip("_")
+    self.fetch = fetch
+    self.ttl = ttl
+    self.value = None
+    self.fetchedAt = None
+    self.refreshTask = None
+    self.loopTask = None
+
+  def isStale(self):
+    return self.fetchedAt is None or time.monotonic(
+    ) - self.fetchedAt >= self.ttl
+
+  async def get(self):
+    if self.fetchedAt is None:
+      Metrics.count(self.metricName + "_cache_misses")
+      await self.refresh()
+    elif self.isStale():
+      Metrics.count(self.metricName + "_cache_stale_hits")
+      self.refreshInBackground()
+    else:
+      Metrics.count(self.metricName + "_cache_hits")
+    return self.value
+
+  def refreshInBackground(self):
+    if self.refreshTask is None or self.refreshTask.done():
+      self.refreshTask = asyncio.create_task(self.doRefresh())
+    return self.refreshTask
+
+  async def refresh(self):
+    #shield, so a cancelled command doesn't cancel the shared fetch
+    await asyncio.shield(self.refreshInBackground())
+    if self.fetchedAt is None:
+      raise Exception("No {name} data available".format(name=self.name))
+
+  async def doRefresh(self):
+    start = time.monotonic()
+    try:
+      self.value = await asyncio.to_thread(self.fetch)
+      self.fetchedAt = time.monotonic()
+      Metrics.observe(self.metricName + "_refresh_seconds",
+                      self.fetchedAt - start)
+      Log.info("Refreshed %s in %.2fs", self.name, self.fetchedAt - start)
+    except Exception:
+      Metrics.count(self.metricName + "_refresh_errors")
+      Log.exception("Refreshing %s failed", self.name)
+
+  def start(self):
+    #warm the cache, so the first command doesn't have to wait
+    return self.refreshInBackground()
+
+  async def refreshLoop(self):
+    while True:
+      await self.refreshInBackground()
+      await asyncio.sleep(self.ttl)
+
+  def keepFresh(self):
+    #refresh every ttl seconds, whether anyone asks for the value or not
+    if self.loopTask is None:
+      self.loopTask = asyncio.create_task(self.refreshLoop())
@@ -0,0 +1,285 @@
+from array import array
+import csv
+import hashlib
+import io
+import logging
+import os
+
+from BackgroundCache import BackgroundCache
+import Metrics
+
+Log = logging.getLogger(__name__)
+
+#corp spreadsheet exported as CSV
+OfferingsCsvUrl = "https://docs.google.com/spreadsheets/d/e/2PACX-1vTU0PDYV0CYk5LObZAFcxIXZNshT27WHvy1CZNmm8paC7eMVmTlCk3rxIFyEY6Tbiz0uiIDG8CxGuCm/pub?gid=0&single=true&output=csv"
+#seconds before the sheet is revalidated in the background
+OfferingsTtl = 600
+#seconds, a hung download would otherwise hold up every refresh of the sheet
+OfferingsRequestTimeout = 30
+
+FioInventoryUrl = "https://rest.fnar.net/csv/inventory?group={group}&apikey={apikey}"
+FioInventoryShipyardGroup = "41707164"
+FioInventoryEv1lGroup = "83373923"
+#seconds before a group inventory is refetched in the background
+FioInventoryTtl = 300
+#seconds, a hung request would otherwise hold up every refresh of the group
+FioRequestTimeout = 30
+ShipPartTickers = (
+    "BR1",
+    "BR2",  #bridges
+    "CQT",
+    "CQS",
+    "CQM",
+    "CQL",  #crew q
+    "FFC",
+    "SFE",
+    "MFE",
+    "LFE",  #FFC, emitters
+    "GEN",
+    "ENG",
+    "FSE",
+    "AEN",
+    "HTE",  #STL engines
+    "RCT",
+    "QCR",
+    "HPR",
+    "HYR",  #FTL engines
+    "SSL",
+    "MSL",
+    "LSL",  #STL fuel tanks
+    "SFL",
+    "MFL",
+    "LFL",  #FTL fuel tanks
+    "TCB",
+    "VSC",
+    "SCB",
+    "MCB",
+    "LCB",
+    "WCB",
+    "VCB",  #cargo bays
+    "SSC",
+    "LHB",
+    "BHP",
+    "RHP",
+    "HHP",
+    "AHP",  #hull plates, SSC
+    "BGS",
+    "AGS",
+    "STS",  #misc
+    "BPT",
+    "APT",
+    "BWH",
+    "AWH",  #whipple shields and thermal protection
+    "RDS",
+    "RDL",  #repair drones
+    "BRP",
+    "ARP",
+    "SRP"  #anti-radiation plates
+)
+
+class GroupInventory:
+  # Compact copy of one FIO group inventory. Usernames and tickers are
+  # interned to small integer ids, and the summed amounts are kept in two
+  # sorted arrays: (userId << 16 | tickerId) keys and their amounts.
+  # A download that hashes the same as the previous one is not parsed again,
+  # otherwise the per-user changes are worked out and only the tickers that
+  # changed get their holder lists rebuilt.
+
+  def __init__(self, group):
+    self.group = group
+    self.users = []
+    self.userIds = {}
+    self.tickers = []
+    self.tickerIds = {}
+    self.keys = array("Q")
+    self.amounts = array("q")
+    self.digest = None
+    #ticker -> [(user, amount)], biggest holders first
+    self.holders = {}
+    #the delta output: user -> {ticker: (old amount, new amount)} between
+    #the last two downloads, empty when the last one didn't change anything
+    self.lastDeltas = {}
+
+  def fetch(self):
+    #blocking, runs in a worker thread of the group's BackgroundCache
+    import requests
+
+    fioUrl = FioInventoryUrl.format(apikey=os.getenv("FIO_API_KEY"),
+                                    group=self.group)
+    with Metrics.Timer("fio_inventory_http_seconds"):
+      response = requests.get(fioUrl, timeout=FioRequestTimeout)
+    if response.status_code != 200:
+      raise Exception(
+          "Error fetching inventory from FIO. status: {status}".format(
+              status=response.status_code))
+    digest = hashlib.sha256(response.content).digest()
+    if digest == self.digest:
+      Metrics.count("fio_inventory_unchanged")
+      self.lastDeltas = {}
+      return self.holders
+    self.ingest(response.content, response.encoding or "utf-8")
+    self.digest = digest
+    return self.holders
+
+  def intern(self, value, ids, values):
+    if value not in ids:
+      ids[value] = len(values)
+      values.append(value)
+    return ids[value]
+
+  def ingest(self, content, encoding):
+    #reads the CSV row by row straight from the downloaded bytes
+    rows = csv.reader(
+        io.TextIOWrapper(io.BytesIO(content), encoding=encoding, newline=""))
+    header = next(rows, [])
+    totals = {}
+    if header:
+      userColumn = header.index("Username")
+      tickerColumn = header.index("Ticker")
+      amountColumn = header.index("Amount")
+      for row in rows:
+        if not row:
+          continue
+        key = self.intern(row[userColumn], self.userIds, self.users) << 16 | \
+            self.intern(row[tickerColumn], self.tickerIds, self.tickers)
+        totals[key] = totals.get(key, 0) + int(row[amountColumn])
+    keys = array("Q", sorted(totals))
+    amounts = array("q", [totals[k] for k in keys])
+    changedTickerIds = self.diff(keys, amounts)
+    self.keys = keys
+    self.amounts = amounts
+    self.updateHolders(totals, changedTickerIds)
+    Metrics.count("fio_inventory_changed_users", len(self.lastDeltas))
+    print("FIO group", self.group, "inventory:", len(self.lastDeltas),
+          "users changed")
+    #formatting every change is only worth it when someone reads them
+    if not Log.isEnabledFor(logging.DEBUG):
+      return
+    for (user, changes) in self.lastDeltas.items():
+      Log.debug("FIO group %s: %s %s", self.group, user, ", ".join(
+          "{ticker} {old}->{new}".format(ticker=ticker, old=old, new=new)
+          for (ticker, (old, new)) in sorted(changes.items())))
+
+  def diff(self, keys, amounts):
+    #walks the old and new sorted key arrays side by side
+    oldKeys = self.keys
+    oldAmounts = self.amounts
+    deltas = {}
+    changedTickerIds = set()
+    i = 0
+    j = 0
+    while i < len(oldKeys) or j < len(keys):
+      if j >= len(keys) or (i < len(oldKeys) and oldKeys[i] < keys[j]):
+        key, old, new = oldKeys[i], oldAmounts[i], 0
+        i += 1
+      elif i >= len(oldKeys) or keys[j] < oldKeys[i]:
+        key, old, new = keys[j], 0, amounts[j]
+        j += 1
+      else:
+        key, old, new = keys[j], oldAmounts[i], amounts[j]
+        i += 1
+        j += 1
+      if old == new:
+        continue
+      user = self.users[key >> 16]
+      if user not in deltas:
+        deltas[user] = {}
+      deltas[user][self.tickers[key & 0xFFFF]] = (old, new)
+      changedTickerIds.add(key & 0xFFFF)
+    self.lastDeltas = deltas
+    return changedTickerIds
+
+  def updateHolders(self, totals, changedTickerIds):
+    rebuilt = {tickerId: [] for tickerId in changedTickerIds}
+    if rebuilt:
+      for (key, amount) in totals.items():
+        #empty stacks count as not holding the ticker, like a missing row
+        if amount and key & 0xFFFF in rebuilt:
+          rebuilt[key & 0xFFFF].append((self.users[key >> 16], amount))
+    #commands may still be reading the old index, so build a new one
+    holders = dict(self.holders)
+    for (tickerId, tickerHolders) in rebuilt.items():
+      ticker = self.tickers[tickerId]
+      if tickerHolders:
+        tickerHolders.sort(key=lambda x: x[1], reverse=True)
+        holders[ticker] = tickerHolders
+      else:
+        holders.pop(ticker, None)
+    self.holders = holders
+
+
+InventoryCaches = {
+    group: BackgroundCache("FIO group {group} inventory".format(group=group),
+                           GroupInventory(group).fetch, FioInventoryTtl)
+    for group in (FioInventoryShipyardGroup, FioInventoryEv1lGroup)
+}
+
+
+async def findInInventories(ticker):
+  isShipPartTicker = ticker in ShipPartTickers
+  group = FioInventoryShipyardGroup if isShipPartTicker else FioInventoryEv1lGroup
+  holders = await InventoryCaches[group].get()
+  return holders.get(ticker, [])
+
+
+class SellerSheet:
+  #corp offerings sheet parsed into ticker -> {seller}, revalidated with
+  #conditional requests so an unchanged sheet isn't downloaded and parsed again
+
+  def __init__(self, url):
+    self.url = url
+    self.etag = None
+    self.lastModified = None
+    self.sellers = {}
+
+  def fetch(self):
+    #blocking, runs in a worker thread of SellersCache
+    import requests
+
+    headers = {}
+    if self.etag:
+      headers["If-None-Match"] = self.etag
+    if self.lastModified:
+      headers["If-Modified-Since"] = self.lastModified
+    with Metrics.Timer("offerings_http_seconds"):
+      response = requests.get(self.url,
+                              headers=headers,
+                              timeout=OfferingsRequestTimeout)
+    if response.status_code == 304:
+      return self.sellers
+    if response.status_code != 200:
+      raise Exception("Error fetching offerings sheet. status: {status}".format(
+          status=response.status_code))
+    sellers = {}
+    for row in csv.DictReader(response.text.split("\r\n")):
+      if row["MAT"] not in sellers:
+        sellers[row["MAT"]] = set()
+      sellers[row["MAT"]].add(row["Seller"].upper())
+    self.sellers = sellers
+    self.etag = response.headers.get("ETag")
+    self.lastModified = response.headers.get("Last-Modified")
+    return sellers
+
+
+SellersCache = BackgroundCache("offerings sheet",
+                               SellerSheet(OfferingsCsvUrl).fetch,
+                               OfferingsTtl)
+
+
+async def getSellers(ticker):
+  try:
+    sellers = await SellersCache.get()
+  except Exception:
+    return set()
+  return sellers.get(ticker, set())
+
+
+async def lookupHolders(ticker, shouldReturnAll):
+  result = await findInInventories(ticker)
+  #print(str(result))
+  print("Full:", str(result))
+  if not shouldReturnAll:
+    sellers = await getSellers(ticker)
+    print("Sellers:", str(sellers))
+    result = [(u, a) for (u, a) in result if u in sellers]
+  return result
@@ -0,0 +1,76 @@
+DiscordMessageLimit = 2000
+
+#name -> [runs, Discord API calls]
+ApiCallStats = {}
+
+
+def splitMessage(lines, limit=DiscordMessageLimit):
+  #pack lines into as few messages as possible, each at most limit characters
+  chunks = []
+  current = ""
+  for line in lines:
+    while len(line) > limit:
+      if current:
+        chunks.append(current)
+        current = ""
+      chunks.append(line[:limit])
+      line = line[limit:]
+    if not current:
+      current = line
+    elif len(current) + 1 + len(line) <= limit:
+      current += "\n" + line
+    else:
+      chunks.append(current)
+      current = line
+  if current:
+    chunks.append(current)
+  return chunks
+
+
+class MessageComposer:
+  # Collects the output of a command and sends it in as few messages as
+  # possible when the "async with" block ends. ctx may be a command context or
+  # a channel; reply() needs a command context.
+
+  def __init__(self, ctx, name):
+    self.ctx = ctx
+    self.name = name
+    self.lines = []
+    self.asReply = False
+    self.apiCalls = 0
+
+  def add(self, text):
+    self.lines.append(str(text))
+
+  def reply(self, text):
+    self.asReply = True
+    self.add(text)
+
+  async def react(self, emoji):
+    self.apiCalls += 1
+    await self.ctx.message.add_reaction(emoji)
+
+  async def flush(self):
+    chunks = splitMessage(self.lines)
+    self.lines = []
+    for chunk in chunks:
+      self.apiCalls += 1
+      if self.asReply:
+        self.asReply = False
+        await self.ctx.reply(chunk)
+      else:
+        await self.ctx.send(chunk)
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, excType, exc, tb):
+    try:
+      await self.flush()
+    finally:
+      if self.name not in ApiCallStats:
+        ApiCallStats[self.name] = [0, 0]
+      ApiCallStats[self.name][0] += 1
+      ApiCallStats[self.name][1] += self.apiCalls
+      print("{name} made {apiCalls} API calls".format(name=self.name,
+                                                      apiCalls=self.apiCalls))
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+
+Log = logging.getLogger(__name__)
+
+#set BOT_METRICS=0 to turn instrumentation off
+Enabled = os.getenv("BOT_METRICS", "1") != "0"
+
+#upper bounds in seconds
+Buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Histograms = {}
+Counters = {}
+#name -> function returning the current value, evaluated when rendering
+Gauges = {}
+ProbeTask = None
+Server = None
+
+
+class Histogram:
+
+  def __init__(self):
+    self.counts = [0] * (len(Buckets) + 1)
+    self.count = 0
+    self.sum = 0
+    self.max = 0
+
+  def observe(self, value):
+    i = 0
+    while i < len(Buckets) and value > Buckets[i]:
+      i += 1
+    self.counts[i] += 1
+    self.count += 1
+    self.sum += value
+    if value > self.max:
+      self.max = value
+
+  def quantile(self, q):
+    #upper bound of the bucket the quantile falls into
+    rank = q * self.count
+    seen = 0
+    for (i, count) in enumerate(self.counts):
+      seen += count
+      if seen >= rank and count:
+        return Buckets[i] if i < len(Buckets) else self.max
+    return 0
+
+
+def observe(name, seconds):
+  if not Enabled:
+    return
+  if name not in Histograms:
+    Histograms[name] = Histogram()
+  Histograms[name].observe(seconds)
+
+
+def count(name, amount=1):
+  if not Enabled:
+    return
+  Counters[name] = Counters.get(name, 0) + amount
+
+
+def gauge(name, valueFunc):
+  Gauges[name] = valueFunc
+
+
+class Timer:
+  # with Metrics.Timer("fio_inventory_http_seconds"): ...
+
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, excType, exc, tb):
+    observe(self.name, time.perf_counter() - self.start)
+
+
+def gaugeValues():
+  values = {}
+  for (name, valueFunc) in Gauges.items():
+    try:
+      values[name] = valueFunc()
+    except Exception:
+      Log.exception("Reading gauge %s failed", name)
+  return values
+
+
+def renderText():
+  #plain text, one metric per line, for the local endpoint
+  lines = []
+  for (name, hist) in sorted(Histograms.items()):
+    cumulative = 0
+    for (i, bound) in enumerate(Buckets):
+      cumulative += hist.counts[i]
+      lines.append('{name}_bucket{{le="{bound}"}} {count}'.format(
+          name=name, bound=bound, count=cumulative))
+    lines.append('{name}_bucket{{le="+Inf"}} {count}'.format(name=name,
+                                                             count=hist.count))
+    lines.append("{name}_sum {sum:.6f}".format(name=name, sum=hist.sum))
+    lines.append("{name}_count {count}".format(name=name, count=hist.count))
+  for (name, value) in sorted(Counters.items()):
+    lines.append("{name} {value}".format(name=name, value=value))
+  for (name, value) in sorted(gaugeValues().items()):
+    lines.append("{name} {value}".format(name=name, value=value))
+  return "\n".join(lines) + "\n"
+
+
+def renderSummary():
+  #short human readable version for the $metrics command
+  if not Enabled:
+    return ["Metrics are disabled"]
+  lines = []
+  for (name, hist) in sorted(Histograms.items()):
+    lines.append(
+        "{name}: n={count} avg={avg:.1f}ms p50<={p50:.0f}ms p95<={p95:.0f}ms max={max:.1f}ms"
+        .format(name=name,
+                count=hist.count,
+                avg=hist.sum / hist.count * 1000,
+                p50=hist.quantile(0.5) * 1000,
+                p95=hist.quantile(0.95) * 1000,
+                max=hist.max * 1000))
+  for (name, value) in sorted(Counters.items()):
+    lines.append("{name}: {value}".format(name=name, value=value))
+  for (name, value) in sorted(gaugeValues().items()):
+    lines.append("{name}: {value}".format(name=name, value=value))
+  return lines
+
+
+async def eventLoopLagProbe(interval=0.5):
+  #how late a sleep wakes up is how long the loop was busy with something else
+  while True:
+    start = time.perf_counter()
+    await asyncio.sleep(interval)
+    observe("event_loop_lag_seconds", time.perf_counter() - start - interval)
+
+
+async def handleRequest(reader, writer):
+  try:
+    await reader.readuntil(b"\r\n\r\n")
+    body = renderText().encode()
+    writer.write(
+        b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; charset=utf-8\r\n" +
+        "Content-Length: {length}\r\n\r\n".format(
+            length=len(body)).encode() + body)
+    await writer.drain()
+  except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+          ConnectionError):
+    pass
+  finally:
+    writer.close()
+
+
+async def start(port):
+  #serves renderText() on localhost only, and starts the loop lag probe
+  global ProbeTask
+  global Server
+  if not Enabled or Server:
+    return
+  ProbeTask = asyncio.create_task(eventLoopLagProbe())
+  try:
+    Server = await asyncio.start_server(handleRequest, "127.0.0.1", port)
+  except OSError:
+    Log.exception("Can't serve metrics on port %d", port)
+    return
+  print("Serving metrics on http://127.0.0.1:{port}/".format(port=port))
@@ -1,5 +1,4 @@
 import argparse
-import requests
 
 LMSearchUrl = "https://rest.fnar.net/localmarket/search"
 
@@ -24,6 +23,9 @@ def main():
     parser.add_argument("origin", nargs="?", default="Katoa", help="planet where you want to deliver the material")
     args = parser.parse_args()
 
+    #imported after parsing, so --help doesn't wait for it
+    import requests
+
     postData = {
         "SearchBuys" : False,
         "SearchSells" : True,
@@ -3,12 +3,17 @@ import json
 import os.path
 import time
 
-import selenium
-from selenium import webdriver
-from selenium.webdriver import ActionChains
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome import service
+selenium = webdriver = ActionChains = By = Keys = None
+
+def importSelenium():
+    #selenium takes a while to load, so it's only imported once a browser is needed
+    global selenium, webdriver, ActionChains, By, Keys
+    import selenium
+    import selenium.common.exceptions
+    from selenium import webdriver
+    from selenium.webdriver import ActionChains
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
 
 chrome_driver_path = "path to chrome webdriver executable"
 APEX_URL="https://apex.prosperousuniverse.com/#/"
@@ -18,6 +23,7 @@ APEX_PASSWORD="your apex password"
 
 class ApexUtils:
     def __init__(self, driver):
+        importSelenium()
         self.driver = driver
         self.__login()
 
@@ -59,6 +65,7 @@ class ApexUtils:
             scrollbar, 0, scrolldelta).perform()
 
 def main():
+    importSelenium()
     options = webdriver.ChromeOptions()
     #doesn't work well in headless mode...
     #options.add_argument("--headless")
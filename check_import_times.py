@@ -0,0 +1,48 @@
+import argparse
+import os
+import subprocess
+import sys
+
+#module -> (directory it's imported from, budget in ms for "python -X importtime")
+ImportBudgets = {
+    "PrUN_LM": (".", 25),
+    "CX_Trader": (".", 25),
+    "apex_scraper": (".", 25),
+    "Auctions": ("HAL9666", 80),
+    "Inventories": ("HAL9666", 80),
+    "AuctionJournal": ("HAL9666", 80),
+}
+
+def measureImport(module, directory):
+    #cumulative import time in ms, as reported on the last line of -X importtime
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                          cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), directory),
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise Exception(proc.stderr.strip().splitlines()[-1])
+    for line in reversed(proc.stderr.splitlines()):
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    raise Exception("{module} not found in importtime output".format(module=module))
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the scripts import within their startup budgets")
+    parser.add_argument("--runs", type=int, default=5, help="best of this many imports is compared to the budget")
+    args = parser.parse_args()
+
+    failed = False
+    for module, (directory, budget) in ImportBudgets.items():
+        try:
+            best = min(measureImport(module, directory) for _ in range(args.runs))
+        except Exception as ex:
+            print("{module}: import failed: {error}".format(module=module, error=ex))
+            failed = True
+            continue
+        result = "ok" if best <= budget else "OVER BUDGET"
+        print("{module}: {best:.1f}ms (budget {budget}ms) {result}".format(module=module, best=best, budget=budget, result=result))
+        failed = failed or best > budget
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()